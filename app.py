@@ -1,6 +1,12 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, render_template, request
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import threading
+import time
 import re
 
 # Initialize the Flask app
@@ -9,14 +15,109 @@ app = Flask(__name__)
 # Base URL for NASA POWER API
 NASA_BASE_URL = 'https://power.larc.nasa.gov/api/temporal'
 
-# Set of values considered as missing data
-MISSING = {-999, -9999, -99, None}
+# Shared HTTP session so upstream connections (DNS + TLS) are reused across calls.
+# Only failed connects are retried; a read timeout is never repeated.
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': 'BackspaceWeather/1.0'})
+SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64,
+                                      max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.3)))
+
+# (connect, read) timeouts. Each connect attempt is limited to 5s and failed
+# connects are retried twice (up to ~16s with backoff for an unreachable host).
+# The read limit applies to each socket read, not the whole response, and
+# read timeouts are never retried.
+UPSTREAM_TIMEOUT = (5, 30)
+GEOCODE_TIMEOUT = (5, 15)
+
+# Worker pool used to overlap independent upstream calls
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# ------------------------ Response cache ------------------------
+class TTLCache:
+    """
+    Small thread-safe in-process cache whose entries expire after 'ttl' seconds.
+    Oldest entries are evicted once 'maxsize' is reached.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.maxsize:
+                del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+# NASA POWER data is refreshed at most hourly; geocoding results rarely change
+NASA_CACHE = TTLCache(maxsize=1024, ttl=900)
+GEOCODE_CACHE = TTLCache(maxsize=1024, ttl=7 * 24 * 3600)
+
+def nasa_get(url, params):
+    """
+    Fetch a NASA POWER JSON payload, reusing a cached copy when one is fresh.
+    Coordinates are rounded to 3 decimals (~100 m) so nearby points share entries.
+    Cached payloads are shared between requests and must not be mutated.
+    """
+    params = dict(params, latitude=round(params['latitude'], 3), longitude=round(params['longitude'], 3))
+    key = (url, tuple(sorted(params.items())))
+    data = NASA_CACHE.get(key)
+    if data is None:
+        data = orjson.loads(SESSION.get(url, params=params, timeout=UPSTREAM_TIMEOUT).content)
+        if 'properties' in data:
+            NASA_CACHE.set(key, data)
+    return data
 
-# Helper function to handle missing values
+# Missing data is None or a NASA fill value (-99, -999, -9999, all <= -99)
+def is_missing(v):
+    return v is None or v <= -99
+
+# Helper function to handle missing values (same rule as is_missing, inlined
+# since this runs several times per row)
 def mv(v, default=0):
-    return default if v in MISSING else v
+    return default if v is None or v <= -99 else v
+
+# Missing-value fallback plus 0-100 clamp for percentages such as humidity
+def _clamp100(v, default=60):
+    if v is None or v <= -99: return default
+    return 0 if v < 0 else (100 if v > 100 else v)
 
 # ------------------------ Geocoding ------------------------
+# Matches a 'lat,lon' pair such as '40.71, -74.0'
+_LATLON_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+# Nominatim's usage policy allows at most one request per second
+NOMINATIM_MIN_INTERVAL = 1.0
+_nominatim_lock = threading.Lock()
+_nominatim_next = 0.0
+
+def _nominatim_wait():
+    """
+    Block until another Nominatim request is allowed. Concurrent geocodes
+    (e.g. from /api/compare) are spaced out instead of hitting the API at once.
+    """
+    global _nominatim_next
+    # Reserve the next free slot under the lock, then sleep without holding it
+    with _nominatim_lock:
+        now = time.monotonic()
+        slot = max(now, _nominatim_next)
+        _nominatim_next = slot + NOMINATIM_MIN_INTERVAL
+    if slot > now:
+        time.sleep(slot - now)
+
 def get_coordinates(location):
     """
     Convert a location string to latitude and longitude.
@@ -24,62 +125,40 @@ def get_coordinates(location):
     """
     try:
         # Check if input is already in 'lat,lon' format
-        m = re.match(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$', location or '')
+        m = _LATLON_RE.match(location or '')
         if m:
             lat = float(m.group(1)); lon = float(m.group(2))
             return lat, lon, f"{lat:.4f}, {lon:.4f}"
         
+        cached = GEOCODE_CACHE.get(location)
+        if cached is not None:
+            return cached
+
         # Use Nominatim API to geocode the location
         geocoding_url = 'https://nominatim.openstreetmap.org/search'
-        headers = {'User-Agent': 'BackspaceWeather/1.0'}
         params = {'q': location, 'format': 'json', 'limit': 1, 'addressdetails': 1}
-        r = requests.get(geocoding_url, headers=headers, params=params, timeout=15)
-        data = r.json()
+        _nominatim_wait()
+        r = SESSION.get(geocoding_url, params=params, timeout=GEOCODE_TIMEOUT)
+        data = orjson.loads(r.content)
         if data:
-            return float(data[0]['lat']), float(data[0]['lon']), data[0].get('display_name', location)
+            result = float(data[0]['lat']), float(data[0]['lon']), data[0].get('display_name', location)
+            GEOCODE_CACHE.set(location, result)
+            return result
         return None, None, location
     except Exception as e:
         print('Geocoding error:', e)
         return None, None, location
 
-# Convert Fahrenheit to Celsius if needed
-def convert_temp(temp_f, to_celsius=False):
-    if temp_f is None: return None
-    if to_celsius: return round((temp_f - 32) * 5/9, 1)
-    return round(temp_f, 1)
-
-# Format weather data with proper units
-def format_weather_response(data, unit='fahrenheit'):
-    """
-    Converts temperatures in the response to desired unit (°F or °C).
-    """
-    is_celsius = unit.lower() == 'celsius'
-    
-    # Convert current weather
-    if 'current' in data:
-        for k in ['temp','feelsLike','dewPoint','high','low']:
-            if k in data['current'] and data['current'][k] is not None:
-                data['current'][k] = convert_temp(data['current'][k], is_celsius)
-    
-    # Convert hourly weather
-    if 'hourly' in data:
-        for h in data['hourly']:
-            for k in ['temp','feelsLike','dewPoint']:
-                if k in h and h[k] is not None:
-                    h[k] = convert_temp(h[k], is_celsius)
-    
-    # Convert daily forecast
-    if 'forecast' in data:
-        for d in data['forecast']:
-            for k in ['high','low']:
-                if k in d and d[k] is not None:
-                    d[k] = convert_temp(d[k], is_celsius)
-    
-    # Add unit symbol
-    data['unit'] = '°C' if is_celsius else '°F'
-    return data
+# Convert a Celsius value to the requested unit (°C to one decimal, whole °F)
+def to_unit(temp_c, is_celsius=False):
+    if temp_c is None: return None
+    if is_celsius: return round(float(temp_c), 1)
+    return round((temp_c * 9/5) + 32)
 
 # ------------------------ NASA POWER hourly helpers ------------------------
+# Display labels for the hour suffix of a YYYYMMDDHH key, e.g. '13' -> '1 PM'
+HOUR_LABELS = {f"{h:02d}": datetime(2000, 1, 1, h).strftime('%I %p').lstrip('0') for h in range(24)}
+
 def _flatten_hourly_series(series_dict):
     """
     Flatten NASA POWER hourly series data into a simple dict with key=YYYYMMDDHH.
@@ -98,11 +177,13 @@ def _flatten_hourly_series(series_dict):
         out = dict(series_dict)
     return out
 
-def get_power_hourly(lat, lon, hours=24):
+def get_power_hourly(lat, lon, hours=24, unit='fahrenheit'):
     """
     Fetch last 48 hours of hourly weather from NASA POWER API
-    and return last 'hours' with valid values.
+    and return last 'hours' with valid values, temperatures in 'unit'.
+    Also returns the unrounded precipitation total (mm) over those hours.
     """
+    is_c = unit.lower() == 'celsius'
     end = datetime.utcnow()
     start = end - timedelta(hours=47)
     
@@ -117,11 +198,10 @@ def get_power_hourly(lat, lon, hours=24):
         'format': 'JSON',
         'time-standard': 'UTC'
     }
-    r = requests.get(url, params=params, timeout=30)
-    data = r.json()
+    data = nasa_get(url, params)
     
     if 'properties' not in data or 'parameter' not in data['properties']:
-        return []
+        return [], 0.0
     
     p = data['properties']['parameter']
 
@@ -129,58 +209,55 @@ def get_power_hourly(lat, lon, hours=24):
     series = {k: _flatten_hourly_series(p.get(k, {})) for k in
               ['T2M','RH2M','WS2M','PS','PRECTOTCORR','ALLSKY_SFC_UV_INDEX','T2MDEW']}
     
-    all_keys = sorted(set(series['T2M'].keys()) | set(series['PRECTOTCORR'].keys()))
+    t2m_s, rh_s, ws_s, ps_s = series['T2M'], series['RH2M'], series['WS2M'], series['PS']
+    precip_s, uvi_s, dew_s = series['PRECTOTCORR'], series['ALLSKY_SFC_UV_INDEX'], series['T2MDEW']
+
+    # Rows need a valid T2M, so only its keys matter. NASA POWER returns them in
+    # chronological order and dicts keep that order, so no union or sort is needed.
+    # Only the last 'hours' valid rows are returned, so only those are built.
+    keys = [k for k, v in t2m_s.items() if not is_missing(v)][-hours:]
 
     rows = []
-    for key in all_keys:
-        t2m = series['T2M'].get(key)
-        if t2m in MISSING:
-            continue
-        
-        # Parse datetime from key
-        try:
-            dt = datetime.strptime(key, '%Y%m%d%H')
-            label = dt.strftime('%I %p').lstrip('0')
-        except:
-            label = key[-2:]
+    precip_total = 0.0
+    for key in keys:
+        # Hour label from the key suffix
+        label = HOUR_LABELS.get(key[-2:], key[-2:])
 
         # Extract and convert values
-        temp_c = mv(t2m, 20)
-        rh = max(0, min(100, mv(series['RH2M'].get(key), 60)))
-        ws_ms = max(0, mv(series['WS2M'].get(key), 0))
-        ps_kpa = series['PS'].get(key)
-        precip_mmhr = max(0, mv(series['PRECTOTCORR'].get(key), 0))
-        uvi = max(0, mv(series['ALLSKY_SFC_UV_INDEX'].get(key), 0))
-        dew_c = mv(series['T2MDEW'].get(key), temp_c - 2)
+        temp_c = t2m_s[key]
+        rh = _clamp100(rh_s.get(key))
+        ws_ms = max(0, mv(ws_s.get(key), 0))
+        ps_kpa = ps_s.get(key)
+        precip_mmhr = max(0, mv(precip_s.get(key), 0))
+        precip_total += precip_mmhr
+        uvi = max(0, mv(uvi_s.get(key), 0))
+        dew_c = mv(dew_s.get(key), temp_c - 2)
 
         # Convert units
-        temp_f = round((temp_c * 9/5) + 32)
-        dew_f = round((dew_c * 9/5) + 32)
+        temp_out = to_unit(temp_c, is_c)
         wind_mph = round(ws_ms * 2.237)
-        ps_inhg = round(mv(ps_kpa, 0) * 0.2953, 2) if ps_kpa not in MISSING else None
+        ps_inhg = None if is_missing(ps_kpa) else round(ps_kpa * 0.2953, 2)
 
         # Determine weather condition and icon
         cond, icon = get_weather_condition(temp_c, rh, precip_mmhr, is_hourly=True)
         
         rows.append({
             'time': label,
-            'temp': temp_f,
+            'temp': temp_out,
             'icon': icon,
             'precipitation': round(precip_mmhr, 2),
             'humidity': rh,
             'wind': wind_mph,
-            'feelsLike': temp_f,
+            'feelsLike': temp_out,
             'description': cond,
             'pressure': ps_inhg,
             'uvIndex': round(uvi),
-            'dewPoint': dew_f
+            'dewPoint': to_unit(dew_c, is_c)
         })
     
-    # Keep only the last 'hours'
-    rows = rows[-hours:]
     if rows:
         rows[-1]['time'] = 'Now'  # Label the latest hour as 'Now'
-    return rows
+    return rows, precip_total
 
 def get_weather_condition(temp_c, humidity, precip_amount, is_hourly=True):
     """
@@ -197,92 +274,118 @@ def get_weather_condition(temp_c, humidity, precip_amount, is_hourly=True):
     return 'Clear', '☀️'
 
 # ------------------------ NASA: current + trend ------------------------
-def get_real_weather_data_by_point(lat, lon, display_name=None):
+def get_real_weather_data_by_point(lat, lon, display_name=None, unit='fahrenheit'):
     """
     Get current weather and hourly trend for a specific lat/lon using NASA POWER.
+    Temperatures are returned in 'unit'.
     """
     try:
         name = display_name or f"{lat:.4f}, {lon:.4f}"
-        today = datetime.utcnow()
-        start = (today - timedelta(days=7)).strftime('%Y%m%d')
-        end = today.strftime('%Y%m%d')
-        url = f'{NASA_BASE_URL}/daily/point'
-        params = {
-            'parameters': 'T2M,T2M_MAX,T2M_MIN,RH2M,PRECTOTCORR,WS2M,PS,ALLSKY_SFC_UV_INDEX,T2MDEW',
-            'community': 'RE',
-            'longitude': lon,
-            'latitude': lat,
-            'start': start,
-            'end': end,
-            'format': 'JSON'
-        }
-        resp = requests.get(url, params=params, timeout=30).json()
-        if 'properties' not in resp or 'parameter' not in resp['properties']:
-            return None, None, name
-        p = resp['properties']['parameter']
-
-        # Helper to get latest valid value for a parameter
-        def latest(param, default=None):
-            values = p.get(param, {})
-            for k in sorted(values.keys(), reverse=True):
-                if values[k] not in MISSING:
-                    return values[k]
-            return default
-
-        # Extract main weather parameters
-        temp_c = mv(latest('T2M'), 20)
-        rh = max(0, min(100, mv(latest('RH2M'), 60)))
-        precip_24h_mm = max(0, mv(latest('PRECTOTCORR'), 0.0))
-        tmax_c = mv(latest('T2M_MAX'), temp_c)
-        tmin_c = mv(latest('T2M_MIN'), temp_c)
-        dew_c = mv(latest('T2MDEW'), temp_c - 2)
-        ws_ms = max(0, mv(latest('WS2M'), 0))
-        ps_kpa = latest('PS')
-
-        # Fetch hourly data for last 24 hours
-        hourly = get_power_hourly(lat, lon, hours=24)
-        last_hour_precip = hourly[-1]['precipitation'] if hourly else 0.0
-        last_hour_uvi = hourly[-1]['uvIndex'] if hourly else max(0, mv(latest('ALLSKY_SFC_UV_INDEX'), 0))
-        last_hour_pressure = hourly[-1].get('pressure') if hourly else (round(mv(ps_kpa, 0) * 0.2953, 2) if ps_kpa not in MISSING else None)
-        last_hour_dew_f = hourly[-1].get('dewPoint') if hourly else round((dew_c * 9/5) + 32)
-
-        # Convert units
-        temp_f = round((temp_c * 9/5) + 32)
-        tmax_f = round((tmax_c * 9/5) + 32)
-        tmin_f = round((tmin_c * 9/5) + 32)
-        wind_mph = round(ws_ms * 2.237)
-
-        # Determine condition
-        cond, icon = get_weather_condition(temp_c, rh, last_hour_precip, is_hourly=True)
-
-        # Prepare current weather dictionary
+        hourly, precip_24h_mm = get_power_hourly(lat, lon, hours=24, unit=unit)
+        if not hourly:
+            # No usable hourly data: fall back to the latest daily values
+            return _current_from_daily(lat, lon, unit), [], name
+
+        # Derive current conditions from the latest hour and the 24h window
+        last = hourly[-1]
+        temps = [h['temp'] for h in hourly]
         current_weather = {
-            'temp': temp_f,
-            'condition': cond,
-            'description': cond,
-            'precipitation': round(last_hour_precip, 2),
+            'temp': last['temp'],
+            'condition': last['description'],
+            'description': last['description'],
+            'precipitation': last['precipitation'],
             'precipLast24h': round(precip_24h_mm, 2),
-            'humidity': rh,
-            'wind': wind_mph,
-            'pressure': last_hour_pressure,
+            'humidity': last['humidity'],
+            'wind': last['wind'],
+            'pressure': last['pressure'],
             'visibility': 10,
-            'uvIndex': last_hour_uvi,
-            'dewPoint': last_hour_dew_f,
-            'feelsLike': temp_f,
-            'icon': icon,
-            'high': tmax_f,
-            'low': tmin_f
+            'uvIndex': last['uvIndex'],
+            'dewPoint': last['dewPoint'],
+            'feelsLike': last['feelsLike'],
+            'icon': last['icon'],
+            'high': max(temps),
+            'low': min(temps)
         }
         return current_weather, hourly, name
     except Exception as e:
         print('NASA POWER error:', e)
         return None, None, display_name or 'Unknown'
 
+def _current_from_daily(lat, lon, unit='fahrenheit'):
+    """
+    Build current weather from the latest daily NASA POWER values.
+    Used only when no hourly data is available for the point.
+    """
+    is_c = unit.lower() == 'celsius'
+    today = datetime.utcnow()
+    url = f'{NASA_BASE_URL}/daily/point'
+    params = {
+        'parameters': 'T2M,T2M_MAX,T2M_MIN,RH2M,PRECTOTCORR,WS2M,PS,ALLSKY_SFC_UV_INDEX,T2MDEW',
+        'community': 'RE',
+        'longitude': lon,
+        'latitude': lat,
+        'start': (today - timedelta(days=7)).strftime('%Y%m%d'),
+        'end': today.strftime('%Y%m%d'),
+        'format': 'JSON'
+    }
+    resp = nasa_get(url, params)
+    if 'properties' not in resp or 'parameter' not in resp['properties']:
+        return None
+    p = resp['properties']['parameter']
+
+    # Helper to get latest valid value for a parameter (keys are in date order)
+    def latest(param, default=None):
+        values = p.get(param, {})
+        return next((v for v in reversed(values.values()) if not is_missing(v)), default)
+
+    # Extract main weather parameters
+    temp_c = mv(latest('T2M'), 20)
+    rh = _clamp100(latest('RH2M'))
+    precip_24h_mm = max(0, mv(latest('PRECTOTCORR'), 0.0))
+    tmax_c = mv(latest('T2M_MAX'), temp_c)
+    tmin_c = mv(latest('T2M_MIN'), temp_c)
+    dew_c = mv(latest('T2MDEW'), temp_c - 2)
+    ws_ms = max(0, mv(latest('WS2M'), 0))
+    ps_kpa = latest('PS')
+    uvi = max(0, mv(latest('ALLSKY_SFC_UV_INDEX'), 0))
+
+    # Convert units
+    temp_out = to_unit(temp_c, is_c)
+
+    # Determine condition (no hourly precipitation is known here)
+    cond, icon = get_weather_condition(temp_c, rh, 0.0, is_hourly=True)
+
+    return {
+        'temp': temp_out,
+        'condition': cond,
+        'description': cond,
+        'precipitation': 0.0,
+        'precipLast24h': round(precip_24h_mm, 2),
+        'humidity': rh,
+        'wind': round(ws_ms * 2.237),
+        'pressure': round(ps_kpa * 0.2953, 2) if ps_kpa is not None else None,
+        'visibility': 10,
+        'uvIndex': uvi,
+        'dewPoint': to_unit(dew_c, is_c),
+        'feelsLike': temp_out,
+        'icon': icon,
+        'high': to_unit(tmax_c, is_c),
+        'low': to_unit(tmin_c, is_c)
+    }
+
 # ------------------------ NASA POWER daily trend ------------------------
-def get_real_forecast_trend(lat, lon, days=7):
+def _parse_key(key):
+    """
+    Parse a NASA POWER YYYYMMDD daily key without going through strptime.
+    """
+    return datetime(int(key[0:4]), int(key[4:6]), int(key[6:8]))
+
+def get_real_forecast_trend(lat, lon, days=7, unit='fahrenheit'):
     """
     Fetch recent daily trends (not future forecast) for a location.
+    Temperatures are returned in 'unit'.
     """
+    is_c = unit.lower() == 'celsius'
     try:
         end = datetime.utcnow()
         start = end - timedelta(days=days-1)
@@ -296,28 +399,33 @@ def get_real_forecast_trend(lat, lon, days=7):
             'end': end.strftime('%Y%m%d'),
             'format': 'JSON'
         }
-        resp = requests.get(url, params=params, timeout=30).json()
+        resp = nasa_get(url, params)
         if 'properties' not in resp or 'parameter' not in resp['properties']:
             return None
         p = resp['properties']['parameter']
-        dates = sorted(p.get('T2M_MAX', {}).keys())
+        tmax_s, tmin_s = p.get('T2M_MAX', {}), p.get('T2M_MIN', {})
+        rh_s, precip_s, wind_s = p.get('RH2M', {}), p.get('PRECTOTCORR', {}), p.get('WS2M', {})
+        # NASA POWER returns YYYYMMDD keys in chronological order
+        dates = list(tmax_s)
+
         out = []
         for dk in dates[-days:]:
-            d = datetime.strptime(dk, '%Y%m%d')
-            tmax_c = mv(p['T2M_MAX'].get(dk), 20)
-            tmin_c = mv(p['T2M_MIN'].get(dk), 10)
-            rh = max(0, min(100, mv(p.get('RH2M', {}).get(dk), 60)))
-            precip_mm = max(0, mv(p.get('PRECTOTCORR', {}).get(dk), 0))
-            wind_ms = max(0, mv(p.get('WS2M', {}).get(dk), 5))
+            d = _parse_key(dk)
+            tmax_c = mv(tmax_s.get(dk), 20)
+            tmin_c = mv(tmin_s.get(dk), 10)
+            rh = _clamp100(rh_s.get(dk))
+            precip_mm = max(0, mv(precip_s.get(dk), 0))
+            wind_ms = max(0, mv(wind_s.get(dk), 5))
+            cond, icon = get_weather_condition((tmax_c+tmin_c)/2, rh, precip_mm, is_hourly=False)
             
             out.append({
                 'date': d.strftime('%a, %b %d'),
-                'high': round((tmax_c * 9/5) + 32),
-                'low': round((tmin_c * 9/5) + 32),
+                'high': to_unit(tmax_c, is_c),
+                'low': to_unit(tmin_c, is_c),
                 'precipitation': round(precip_mm, 2),
-                'condition': get_weather_condition((tmax_c+tmin_c)/2, rh, precip_mm, is_hourly=False)[0],
-                'description': get_weather_condition((tmax_c+tmin_c)/2, rh, precip_mm, is_hourly=False)[0],
-                'icon': get_weather_condition((tmax_c+tmin_c)/2, rh, precip_mm, is_hourly=False)[1],
+                'condition': cond,
+                'description': cond,
+                'icon': icon,
                 'humidity': rh,
                 'wind': round(wind_ms * 2.237),
             })
@@ -341,7 +449,7 @@ def get_event_advice(lat, lon, start_local_iso, end_local_iso, unit='fahrenheit'
             'forecast_days': 14,
             'timezone': 'auto'
         }
-        resp = requests.get(url, params=params, timeout=30).json()
+        resp = orjson.loads(SESSION.get(url, params=params, timeout=UPSTREAM_TIMEOUT).content)
         hourly = resp.get('hourly', {})
         times = hourly.get('time', [])
         temp_c = hourly.get('temperature_2m', [])
@@ -481,6 +589,15 @@ def get_event_advice(lat, lon, start_local_iso, end_local_iso, unit='fahrenheit'
         return {'error': 'Failed to compute event advice'}, 500
 
 # ------------------------ Routes ------------------------
+@app.before_request
+def _ts():
+    """Stamp the request once so every response field shares one timestamp."""
+    g.ts = datetime.utcnow().isoformat() + 'Z'
+
+def ojson(data, status=200):
+    """Serialize 'data' with orjson into a JSON response."""
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
 @app.route('/')
 def index():
     """Render the main HTML page."""
@@ -504,9 +621,9 @@ def api_weather():
     else:
         display = f"{lat:.4f}, {lon:.4f}"
 
-    current, hourly, name = get_real_weather_data_by_point(lat, lon, display)
+    current, hourly, name = get_real_weather_data_by_point(lat, lon, display, unit)
     if current is None:
-        return jsonify({'error': 'Unable to fetch weather data'}), 400
+        return ojson({'error': 'Unable to fetch weather data'}, 400)
     if hourly and hours < len(hourly):
         hourly = hourly[-hours:]
 
@@ -514,10 +631,11 @@ def api_weather():
         'location': name,
         'current': current,
         'hourly': hourly or [],
-        'timestamp': datetime.utcnow().isoformat() + 'Z',
-        'source': 'NASA POWER API'
+        'timestamp': g.ts,
+        'source': 'NASA POWER API',
+        'unit': '°C' if unit.lower() == 'celsius' else '°F'
     }
-    return jsonify(format_weather_response(data, unit))
+    return ojson(data)
 
 @app.route('/api/forecast')
 def api_forecast():
@@ -536,17 +654,18 @@ def api_forecast():
     else:
         display = f"{lat:.4f}, {lon:.4f}"
 
-    trend = get_real_forecast_trend(lat, lon, days=days)
+    trend = get_real_forecast_trend(lat, lon, days=days, unit=unit)
     if trend is None:
-        return jsonify({'error': 'Unable to fetch trend data'}), 400
+        return ojson({'error': 'Unable to fetch trend data'}, 400)
 
     data = {
         'location': display,
         'forecast': trend,
-        'timestamp': datetime.utcnow().isoformat() + 'Z',
-        'source': 'NASA POWER API'
+        'timestamp': g.ts,
+        'source': 'NASA POWER API',
+        'unit': '°C' if unit.lower() == 'celsius' else '°F'
     }
-    return jsonify(format_weather_response(data, unit))
+    return ojson(data)
 
 @app.route('/api/historical')
 def api_historical():
@@ -579,37 +698,36 @@ def api_historical():
             'end': end.strftime('%Y%m%d'),
             'format': 'JSON'
         }
-        resp = requests.get(url, params=params, timeout=30).json()
+        resp = nasa_get(url, params)
         if 'properties' not in resp or 'parameter' not in resp['properties']:
-            return jsonify({'error': 'Unable to fetch historical data'}), 400
+            return ojson({'error': 'Unable to fetch historical data'}, 400)
         p = resp['properties']['parameter']
 
+        is_c = unit.lower() == 'celsius'
+        precip_s, rh_s = p.get('PRECTOTCORR', {}), p.get('RH2M', {})
+
         hist = []
-        for dk in sorted(p.get('T2M', {}).keys()):
-            d = datetime.strptime(dk, '%Y%m%d')
-            t_c = mv(p['T2M'].get(dk), 20)
-            t_f = round((t_c * 9/5) + 32)
-            precip_mm = max(0, mv(p.get('PRECTOTCORR', {}).get(dk), 0))
-            rh = max(0, min(100, mv(p.get('RH2M', {}).get(dk), 60)))
+        for dk, t2m in p.get('T2M', {}).items():  # keys arrive in chronological order
+            d = _parse_key(dk)
+            t_c = mv(t2m, 20)
+            precip_mm = max(0, mv(precip_s.get(dk), 0))
+            rh = _clamp100(rh_s.get(dk))
             hist.append({
                 'date': d.strftime('%b %d'),
-                'avgTemp': t_f,
+                'avgTemp': to_unit(t_c, is_c),
                 'precipitation': round(precip_mm, 2),
                 'humidity': rh
             })
-        is_c = unit.lower() == 'celsius'
-        for h in hist:
-            h['avgTemp'] = convert_temp(h['avgTemp'], is_c)
-        return jsonify({
+        return ojson({
             'location': display,
             'historical': hist,
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': g.ts,
             'source': 'NASA POWER API',
             'unit': '°C' if is_c else '°F'
         })
     except Exception as e:
         print('Historical error:', e)
-        return jsonify({'error': 'Unable to fetch historical data'}), 400
+        return ojson({'error': 'Unable to fetch historical data'}, 400)
 
 @app.route('/api/event-advice')
 def api_event_advice():
@@ -629,10 +747,10 @@ def api_event_advice():
     if (lat is None or lon is None) and location:
         lat, lon, _ = get_coordinates(location)
     if lat is None or lon is None or not start_local or not end_local:
-        return jsonify({'error': 'lat, lon, start, end are required'}), 400
+        return ojson({'error': 'lat, lon, start, end are required'}, 400)
 
     advice, status = get_event_advice(lat, lon, start_local, end_local, unit=unit, event_type=event_type)
-    return jsonify(advice), status
+    return ojson(advice, status)
 
 @app.route('/api/compare')
 def api_compare():
@@ -642,22 +760,22 @@ def api_compare():
     """
     unit = request.args.get('unit', 'fahrenheit')
     locations = request.args.getlist('locations[]')
-    comparison = []
-    for loc in locations:
-        lat, lon, display = get_coordinates(loc)
-        if lat is None or lon is None:
-            continue
-        current, _, _ = get_real_weather_data_by_point(lat, lon, display)
+
+    def fetch_one(coords):
+        lat, lon, display = coords
+        current, _, _ = get_real_weather_data_by_point(lat, lon, display, unit)
         if not current:
-            continue
-        is_c = unit.lower() == 'celsius'
-        for k in ['temp','feelsLike','dewPoint','high','low']:
-            if k in current and current[k] is not None:
-                current[k] = convert_temp(current[k], is_c)
-        comparison.append({'location': display, 'weather': current})
-    return jsonify({
+            return None
+        return {'location': display, 'weather': current}
+
+    # Geocode in a small dedicated pool so rate-limited Nominatim waits don't
+    # occupy the shared EXECUTOR, then fetch weather for all resolved points
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        coords = [c for c in pool.map(get_coordinates, locations) if c[0] is not None and c[1] is not None]
+    comparison = [c for c in EXECUTOR.map(fetch_one, coords) if c]
+    return ojson({
         'comparison': comparison,
-        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'timestamp': g.ts,
         'source': 'NASA POWER API',
         'unit': '°C' if unit.lower() == 'celsius' else '°F'
     })